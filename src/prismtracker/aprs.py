@@ -22,18 +22,23 @@ logger = logging.getLogger(__name__)
 
 APP_DESTINATION = "APZFSM"
 
+_BASE91_PLACES = (91 ** 3, 91 ** 2, 91, 1)
+
+KISS_FEND = 0xC0
+KISS_FESC = 0xDB
+KISS_TFEND = 0xDC
+KISS_TFESC = 0xDD
+
 def base91_encode(num):
     """
     base91 encode a numeric value
 
     NOTE: this works for values up to 91**4
     """
-    num_places=4
     out = ""
-    while num_places > 0:
-        num_places = num_places - 1
-        out = out + chr(33+int(num / 91 ** num_places))
-        num = (num % 91 ** num_places)
+    for place in _BASE91_PLACES:
+        out = out + chr(33+int(num / place))
+        num = (num % place)
     return out
 
 
@@ -55,6 +60,34 @@ def compress_course_and_speed(deg, kts):
         )
 
 
+def ax25_address(call, last=False, command=False):
+    """
+    encode a callsign with optional -SSID as a 7 byte AX.25 address field
+
+    a trailing '*' marks a digipeater address as already repeated
+    """
+    repeated = call.endswith('*')
+    call = call.rstrip('*')
+    (base, _, ssid) = call.partition('-')
+
+    out = bytearray(ord(char) << 1 for char in base.upper().ljust(6)[:6])
+    ssid_byte = 0x60 | (int(ssid or 0) & 0x0F) << 1
+    if command or repeated:
+        ssid_byte |= 0x80
+    if last:
+        ssid_byte |= 0x01
+    out.append(ssid_byte)
+    return bytes(out)
+
+
+def kiss_encode(data, port=0):
+    """ wrap an AX.25 frame in a KISS data frame """
+
+    escaped = data.replace(bytes((KISS_FESC,)), bytes((KISS_FESC, KISS_TFESC)))
+    escaped = escaped.replace(bytes((KISS_FEND,)), bytes((KISS_FESC, KISS_TFEND)))
+    return bytes((KISS_FEND, (port & 0x0F) << 4)) + escaped + bytes((KISS_FEND,))
+
+
 class APRSFrame:
     """ Base class for APRS Frames """
 
@@ -78,6 +111,17 @@ class APRSFrame:
         frame = self.__repr__()
         return frame.encode()
 
+    def ax25(self):
+        """ returns the frame as an AX.25 UI frame without FCS """
+
+        frame = bytearray(ax25_address(self.destination, command=True))
+        frame.extend(ax25_address(self.source, last=len(self.path) == 0))
+        for num, digi in enumerate(self.path):
+            frame.extend(ax25_address(digi, last=num == len(self.path) - 1))
+        frame.extend((0x03, 0xF0)) # UI frame, no layer 3
+        frame.extend(self.info.encode())
+        return bytes(frame)
+
 
 class PositionReport(APRSFrame):
     """
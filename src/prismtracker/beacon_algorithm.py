@@ -20,6 +20,51 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_OPTIONS = {
+        'interval': 300,
+        'min_interval': 30,
+        'max_interval': 600,
+    }
+
+
+def parse_options(opts_string, defaults=None, label="Algorithm"):
+    """
+    parse comma separated key=value options, beacon algorithm options unless
+    other defaults are given
+
+    keys which aren't in the defaults are ignored with an error, label names
+    the options in the message
+    """
+
+    options = dict(DEFAULT_OPTIONS if defaults is None else defaults)
+    if len(opts_string) > 0:
+        for item in opts_string.split(','):
+            parts = item.split('=')
+            if len(parts) != 2:
+                logger.error("Malformed %s opt: %s, ignoring...", label, item)
+            elif parts[0] not in options:
+                logger.error("Unknown %s opt: %s, ignoring... (known: %s)",
+                        label, parts[0], ", ".join(sorted(options)))
+            else:
+                options[parts[0]] = parts[1]
+    return options
+
+
+def new_algorithm(name, gps_i, options):
+    """ returns the named beacon algorithm, or None if it is unknown """
+
+    if name == 'interval':
+        return BeaconAlgorithmInterval(gps_i, int(options['interval']))
+
+    if name == 'smart':
+        return BeaconAlgorithmSmart(gps_i,
+                int(options['min_interval']),
+                int(options['max_interval']),
+            )
+
+    return None
+
+
 class BeaconAlgorithmInterval():
     """ Interval Beacon Algorithm """
 
@@ -22,6 +22,10 @@ import aprslib
 
 logger = logging.getLogger(__name__)
 
+AX25_BAUD = 1200
+AX25_TXDELAY = 0.3 # seconds of keyup before the frame
+AX25_OVERHEAD = 4 # bytes of flags and FCS around the frame
+
 class BroadcastError(Exception):
     """ For notifying callers that the broadcast failed """
 
@@ -51,6 +55,14 @@ class Broadcast:
         raise NotImplementedError("send_frame() not implemented")
 
 
+    def airtime(self, frame): # pylint: disable=unused-argument
+        """
+        returns the estimated seconds of RF channel time to send a frame,
+        0 for drivers which don't transmit on RF
+        """
+        return 0
+
+
 class BroadcastAx25Beacon(Broadcast):
     """ AX.25 Beacon Broadcast Driver """
 
@@ -81,18 +93,27 @@ class BroadcastAx25Beacon(Broadcast):
         logger.info("frame sent %s", frame)
 
 
+    def airtime(self, frame):
+        return AX25_TXDELAY + (len(frame.ax25()) + AX25_OVERHEAD) * 8 / AX25_BAUD
+
+
 class BroadcastAprsIs(Broadcast):
     """ APRS-IS Broadcast Driver """
 
-    def __init__(self, login, passcode):
+    def __init__(self, login, passcode, host="rotate.aprs.net", port=14580):
         self.login = login
         self.passcode = passcode
 
-        self.connection = aprslib.IS(self.login, self.passcode, port=14580)
+        self.connection = aprslib.IS(self.login, self.passcode, host=host, port=port)
         self.connection.connect()
 
     def send_frame(self, frame):
-        self.connection.sendall(str(frame))
+        try:
+            self.connection.connect() # reconnects if a previous send failed
+            self.connection.sendall(str(frame))
+        except (aprslib.exceptions.ConnectionError, aprslib.exceptions.LoginError) as error:
+            self.connection.close()
+            raise BroadcastError("APRS-IS send failed: {}".format(error)) from error
         logger.info("frame sent: %s", frame)
 
 
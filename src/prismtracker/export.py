@@ -0,0 +1,469 @@
+# prismtracker - An APRS Tracker Daemon
+# Copyright 2021 Philip J Freeman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Offline export of logged GPX tracks to APRS frames and other formats
+
+The GPX file is split into byte range segments which a process pool scans
+for track points.  The beacon algorithm then runs over the points in order
+in the main process, since it depends on the previous report, and the
+selected points are encoded back in the pool and written out chunk by chunk
+in order.
+"""
+
+import argparse
+import array
+import calendar
+import collections
+import csv
+import io
+import json
+import logging
+import mmap
+import multiprocessing
+import os
+import re
+import sys
+import time
+
+from prismtracker import aprs, beacon_algorithm, gps
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('tnc2', 'kiss', 'csv', 'geojson')
+
+_TRK = re.compile(rb'<trk>\s*(?:<name>([^<]*)</name>)?')
+_TRKPT = re.compile(rb'<trkpt\s([^>]*?)(?:/>|>(.*?)</trkpt>)', re.S)
+_ATTR = re.compile(rb'(lat|lon)\s*=\s*["\']([^"\']*)')
+_CHILD = re.compile(rb'<(ele|time|course|speed)>\s*([^<]*?)\s*</')
+_OFFSET = re.compile(rb'([+-])(\d\d):?(\d\d)$')
+
+_DAYS = {}
+
+Points = collections.namedtuple("Points",
+        ("latitude", "longitude", "course", "speed", "altitude", "timestamp"))
+
+
+class GpsInterfaceReplay(gps.GpsInterface):
+    """ GPS Driver replaying recorded points to a beacon algorithm """
+
+    def __init__(self):
+        self.point = None
+
+
+    def load(self, point):
+        """ stage a (lat, lon, course, speed, alt, timestamp) tuple """
+        self.point = point
+
+
+    def update(self):
+        pass
+
+
+    def get_position(self):
+        return (self.point[0], self.point[1])
+
+
+    def get_course_and_speed(self):
+        return (self.point[2], self.point[3])
+
+
+    def get_altitude(self):
+        return self.point[4]
+
+
+    def get_timestring(self):
+        return time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(self.point[5]))
+
+
+    def get_timestamp(self):
+        return self.point[5]
+
+
+def _parse_time(value):
+    """
+    GPX time string to seconds since the epoch
+
+    strptime is slow, so only the date is parsed that way, once per day.
+    Raises ValueError if value isn't an ISO 8601 time.
+    """
+    date = value[:10]
+    if date not in _DAYS:
+        _DAYS[date] = calendar.timegm(time.strptime(date.decode(), '%Y-%m-%d'))
+
+    if value[10:11] not in (b'T', b't') or value[13:14] != b':' or value[16:17] != b':':
+        raise ValueError("bad time {!r}".format(value))
+    seconds = _DAYS[date] + int(value[11:13]) * 3600 + int(value[14:16]) * 60 \
+            + int(value[17:19])
+
+    rest = value[19:]
+    if rest[-1:] in (b'Z', b'z'):
+        rest = rest[:-1]
+    else:
+        offset = _OFFSET.search(rest)
+        if offset is not None:
+            minutes = int(offset.group(2)) * 60 + int(offset.group(3))
+            if offset.group(1) == b'+':
+                minutes = -minutes
+            seconds += minutes * 60
+            rest = rest[:offset.start()]
+    if rest:
+        if rest[:1] != b'.':
+            raise ValueError("bad time {!r}".format(value))
+        seconds += float(b'0' + rest)
+    return seconds
+
+
+def _tracks(buf):
+    """ returns the (start, name) of each track, name is None if it has none """
+
+    tracks = [(match.start(), match.group(1) and match.group(1).decode())
+            for match in _TRK.finditer(buf)]
+    if len(tracks) == 0:
+        tracks = [(0, None)]
+    return tracks
+
+
+def _segments(tracks, size, track_names, segment_size):
+    """ returns (start, end) byte ranges covering the wanted tracks """
+
+    segments = []
+    for num, (start, name) in enumerate(tracks):
+        if track_names and name not in track_names:
+            continue
+        end = tracks[num + 1][0] if num + 1 < len(tracks) else size
+        for seg_start in range(start, end, segment_size):
+            segments.append((seg_start, min(seg_start + segment_size, end)))
+    return segments
+
+
+def _parse_segment(args):
+    """
+    returns the Points of the track points starting in a byte range, and
+    counts of the points without a time and of the unreadable points skipped
+    """
+
+    (path, start, end) = args
+
+    out = Points(*(array.array('d') for _ in Points._fields))
+    untimed = 0
+    skipped = 0
+
+    with open(path, 'rb') as gpx_file:
+        buf = mmap.mmap(gpx_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    for match in _TRKPT.finditer(buf, start):
+        if match.start() >= end:
+            break
+
+        attrs = dict(_ATTR.findall(match.group(1)))
+        children = dict(_CHILD.findall(match.group(2) or b''))
+
+        try:
+            latitude = float(attrs[b'lat'])
+            longitude = float(attrs[b'lon'])
+            course = float(children.get(b'course', 0))
+            speed = float(children.get(b'speed', 0)) * 1.943844 # M/s -> kts
+            altitude = float(children.get(b'ele', 0)) * 3.28084 # M -> ft
+            timestamp = _parse_time(children[b'time']) if b'time' in children else None
+        except (KeyError, ValueError) as error:
+            logger.debug("skipping track point at byte %d: %s", match.start(), error)
+            skipped += 1
+            continue
+
+        out.latitude.append(latitude)
+        out.longitude.append(longitude)
+        out.course.append(course)
+        out.speed.append(speed)
+        out.altitude.append(altitude)
+        if timestamp is None:
+            out.timestamp.append(0)
+            untimed += 1
+        else:
+            out.timestamp.append(timestamp)
+
+    buf.close()
+    return (out, untimed, skipped)
+
+
+def _encode_chunk(args):
+    """ returns the selected points encoded in the output format """
+
+    (points, fmt, frame_opts) = args
+
+    if fmt == 'kiss':
+        out = io.BytesIO()
+    else:
+        out = io.StringIO()
+        if fmt == 'csv':
+            writer = csv.writer(out)
+
+    for num, point in enumerate(zip(*points)):
+        (lat, lon, course, speed, alt, timestamp) = point
+
+        frame = aprs.PositionReport(
+                source = frame_opts['call'],
+                destination = aprs.APP_DESTINATION,
+                path = frame_opts['path'],
+                table = frame_opts['symbol_table'],
+                symbol = frame_opts['symbol'],
+                lat = lat,
+                lon = lon,
+                course = course,
+                speed = speed,
+            )
+        gps_time = time.gmtime(timestamp)
+        if frame_opts['timestamp']:
+            frame.add_timestamp(gps_time.tm_hour, gps_time.tm_min, gps_time.tm_sec)
+        if frame_opts['altitude']:
+            frame.add_altitude(alt)
+
+        if fmt == 'tnc2':
+            out.write(str(frame))
+            out.write("\n")
+        elif fmt == 'kiss':
+            out.write(aprs.kiss_encode(frame.ax25()))
+        elif fmt == 'csv':
+            writer.writerow((time.strftime('%Y-%m-%dT%H:%M:%SZ', gps_time),
+                    lat, lon, course, speed, alt, str(frame)))
+        elif fmt == 'geojson':
+            if num > 0:
+                out.write(",\n")
+            json.dump({
+                    'type': 'Feature',
+                    'geometry': {'type': 'Point', 'coordinates': [lon, lat, alt * 0.3048]},
+                    'properties': {
+                        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', gps_time),
+                        'course': course,
+                        'speed': speed,
+                        'frame': str(frame),
+                    },
+                }, out)
+
+    return out.getvalue()
+
+
+def _select(points, beacon_a, gps_i):
+    """ returns the Points the beacon algorithm would have reported """
+
+    if beacon_a is None:
+        return points
+
+    selected = Points(*(array.array('d') for _ in Points._fields))
+    for point in zip(*points):
+        gps_i.load(point)
+        if beacon_a.check():
+            for (column, value) in zip(selected, point):
+                column.append(value)
+    return selected
+
+
+def main():
+    """ export entrypoint """
+
+    parser = argparse.ArgumentParser(
+            description="Export logged GPX tracks as APRS frames, CSV or GeoJSON",
+        )
+
+    parser.add_argument('gpx',
+            help='GPX file to read',
+        )
+    parser.add_argument('--output', '-o',
+            help='file to write (default stdout)',
+            default=None,
+        )
+    parser.add_argument('--format',
+            help='output format ({})'.format(', '.join(FORMATS)),
+            choices=FORMATS,
+            default='tnc2',
+        )
+    parser.add_argument('--track',
+            help='only export tracks with this name, may be repeated (default '
+                    'positions if there are such tracks, else all tracks)',
+            action='append',
+            default=[],
+        )
+    parser.add_argument('--call',
+            help="Callsign with SSID suffix",
+            default="NOCALL",
+        )
+    parser.add_argument('--path',
+            help="via path",
+            default="WIDE1-1,WIDE2-1",
+        )
+    parser.add_argument('--symbol-table',
+            help='APRS display symbol table',
+            default='/',
+        )
+    parser.add_argument('--symbol',
+            help='APRS display symbol character code',
+            default='>',
+        )
+    parser.add_argument('--timestamp',
+            help='include timestamp in position report',
+            action='store_true',
+        )
+    parser.add_argument('--altitude',
+            help='include altitude in position report',
+            action='store_true',
+        )
+    parser.add_argument('--algorithm',
+            help='Beacon algorithm (all, interval, smart, etc...)',
+            default='all',
+        )
+    parser.add_argument('--algorithm-opts',
+            default='',
+        )
+    parser.add_argument('--jobs', '-j',
+            help='number of worker processes (default one per CPU)',
+            type=int,
+            default=None,
+        )
+    parser.add_argument('--segment-size',
+            help='bytes of GPX per worker task',
+            type=int,
+            default=4 * 1024 * 1024,
+        )
+    parser.add_argument('--loglevel',
+            help='log level (debug, info, warning, error)',
+            default="warning",
+        )
+
+    opts = parser.parse_args()
+
+    logging.basicConfig(
+            level=getattr(logging, opts.loglevel.upper()),
+            format='%(levelname)s %(name)s.%(funcName)s:%(lineno)d - %(message)s'
+        )
+
+    path = []
+    if len(opts.path) > 0:
+        path.extend(opts.path.split(','))
+
+    frame_opts = {
+            'call': opts.call,
+            'path': path,
+            'symbol_table': opts.symbol_table,
+            'symbol': opts.symbol,
+            'timestamp': opts.timestamp,
+            'altitude': opts.altitude,
+        }
+
+    gps_i = GpsInterfaceReplay()
+    beacon_a = None
+    if opts.algorithm != 'all':
+        algorithm_opts = beacon_algorithm.parse_options(opts.algorithm_opts)
+        beacon_a = beacon_algorithm.new_algorithm(opts.algorithm, gps_i, algorithm_opts)
+        if beacon_a is None:
+            logger.error("Unknown Beacon Algorithm: %s", opts.algorithm)
+            return 2
+
+    try:
+        with open(opts.gpx, 'rb') as gpx_file:
+            buf = mmap.mmap(gpx_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError) as error:
+        # mmap raises ValueError for an empty file
+        logger.error("Can't read %s: %s", opts.gpx, error)
+        return 1
+
+    tracks = _tracks(buf)
+    size = len(buf)
+    buf.close()
+
+    names = sorted({name for (_, name) in tracks if name is not None})
+    track_names = opts.track
+    if not track_names and 'positions' in names:
+        # the broadcasts tracks repeat points of the positions tracks
+        logger.info("exporting the positions tracks, use --track for others")
+        track_names = ['positions']
+
+    segments = _segments(tracks, size, track_names, opts.segment_size)
+    if len(segments) == 0:
+        if names:
+            logger.error("No tracks named %s in %s, it has: %s",
+                    ", ".join(track_names), opts.gpx, ", ".join(names))
+        else:
+            logger.error("%s has no named tracks (logs from older versions "
+                    "don't), leave out --track to export all of it", opts.gpx)
+        return 1
+
+    if opts.output is None:
+        out = sys.stdout.buffer
+    else:
+        out = open(opts.output, 'wb')
+
+    if opts.format == 'csv':
+        out.write(b"time,latitude,longitude,course,speed,altitude,frame\r\n")
+    elif opts.format == 'geojson':
+        out.write(b'{"type": "FeatureCollection", "features": [\n')
+
+    total = 0
+    exported = 0
+    untimed = 0
+    skipped = 0
+    pending = collections.deque()
+    started = False
+
+    def write_chunk():
+        nonlocal started
+        chunk = pending.popleft().get()
+        if len(chunk) == 0:
+            return
+        if opts.format == 'kiss':
+            out.write(chunk)
+            return
+        if opts.format == 'geojson' and started:
+            out.write(b",\n")
+        out.write(chunk.encode())
+        started = True
+
+    jobs = opts.jobs or os.cpu_count()
+    with multiprocessing.Pool(jobs) as pool:
+        for (points, seg_untimed, seg_skipped) in pool.imap(_parse_segment,
+                [(opts.gpx, start, end) for (start, end) in segments]):
+            total += len(points.latitude)
+            untimed += seg_untimed
+            skipped += seg_skipped
+
+            selected = _select(points, beacon_a, gps_i)
+            exported += len(selected.latitude)
+
+            pending.append(pool.apply_async(_encode_chunk,
+                    ((selected, opts.format, frame_opts),)))
+            while len(pending) > jobs * 2 or (pending and pending[0].ready()):
+                write_chunk()
+
+        while pending:
+            write_chunk()
+
+    if opts.format == 'geojson':
+        out.write(b"\n]}\n")
+    if out is not sys.stdout.buffer:
+        out.close()
+
+    if skipped > 0:
+        logger.warning("skipped %d track points with unreadable coordinates or times",
+                skipped)
+    if untimed > 0 and beacon_a is not None:
+        logger.warning("%d points had no time, the beacon algorithm saw them at 0", untimed)
+    if total == 0:
+        logger.error("No track points found in %s", opts.gpx)
+        return 1
+    logger.info("exported %d of %d points", exported, total)
+    return 0
+
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,262 @@
+# prismtracker - An APRS Tracker Daemon
+# Copyright 2021 Philip J Freeman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Shared memory bus for publishing the latest fix to other local processes
+
+The bus is a small memory mapped file (by default in /dev/shm) with a fixed
+little endian layout:
+
+    offset  type     field
+    0       char[4]  magic "PTFX"
+    4       uint32   layout version (1)
+    8       uint64   sequence number, odd while a write is in progress
+    16      double   latitude in decimal degrees
+    24      double   longitude in decimal degrees
+    32      double   course in degrees
+    40      double   speed in knots
+    48      double   altitude in feet
+    56      double   GPS timestamp in seconds since the epoch
+
+There is a single writer.  Readers use the sequence number as a seqlock:
+read it, read the fix, and read it again; the fix is consistent if both
+reads returned the same even number.  Readers never take a lock and never
+block the writer.
+"""
+
+import argparse
+import collections
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATH = "/dev/shm/prismtracker-fix"
+
+MAGIC = b"PTFX"
+LAYOUT_VERSION = 1
+
+_HEADER = struct.Struct("<4sI")
+_SEQ = struct.Struct("<Q")
+_FIX = struct.Struct("<6d")
+_SEQ_OFFSET = _HEADER.size
+_FIX_OFFSET = _SEQ_OFFSET + _SEQ.size
+SIZE = _FIX_OFFSET + _FIX.size
+
+Fix = collections.namedtuple("Fix",
+        ("latitude", "longitude", "course", "speed", "altitude", "timestamp"))
+
+
+class FixBusError(Exception):
+    """ For notifying callers that the bus can't be used """
+
+
+class FixBusWriter:
+    """ Publishes fixes to the bus """
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, SIZE)
+            self.map = mmap.mmap(fd, SIZE, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+
+        # carry on from an existing bus, so readers polling sequence() see a
+        # restarted writer's fixes as new
+        self.seq = 0
+        if _HEADER.unpack_from(self.map, 0) == (MAGIC, LAYOUT_VERSION):
+            self.seq = _SEQ.unpack_from(self.map, _SEQ_OFFSET)[0]
+            self.seq += self.seq & 1 # the last writer died mid-write
+        _SEQ.pack_into(self.map, _SEQ_OFFSET, self.seq)
+        _HEADER.pack_into(self.map, 0, MAGIC, LAYOUT_VERSION)
+
+
+    def publish(self, latitude, longitude, course, speed, altitude, timestamp):
+        """ publish a new fix """
+
+        self.seq += 1
+        _SEQ.pack_into(self.map, _SEQ_OFFSET, self.seq)
+        _FIX.pack_into(self.map, _FIX_OFFSET,
+                latitude, longitude, course, speed, altitude, timestamp)
+        self.seq += 1
+        _SEQ.pack_into(self.map, _SEQ_OFFSET, self.seq)
+
+
+    def close(self):
+        """ unmap the bus, leaving the last fix in place for readers """
+
+        self.map.close()
+
+
+class FixBusReader:
+    """ Reads the latest fix from the bus """
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            self.map = mmap.mmap(fd, SIZE, mmap.MAP_SHARED, mmap.PROT_READ)
+        except ValueError as error:
+            raise FixBusError("{}: {}".format(path, error)) from error
+        finally:
+            os.close(fd)
+
+        (magic, version) = _HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != LAYOUT_VERSION:
+            self.map.close()
+            raise FixBusError("{}: not a version {:d} fix bus".format(path, LAYOUT_VERSION))
+
+
+    def sequence(self):
+        """
+        returns the current sequence number
+
+        this changes whenever a new fix is published, so it can be polled
+        cheaply to see if read() would return something new
+        """
+        return _SEQ.unpack_from(self.map, _SEQ_OFFSET)[0]
+
+
+    def read(self, retries=100):
+        """
+        returns the latest Fix, or None if nothing has been published yet
+
+        raises a FixBusError if no consistent fix could be read after
+        retries attempts
+        """
+
+        for _ in range(retries):
+            seq = _SEQ.unpack_from(self.map, _SEQ_OFFSET)[0]
+            if not seq & 1:
+                fix = _FIX.unpack_from(self.map, _FIX_OFFSET)
+                if _SEQ.unpack_from(self.map, _SEQ_OFFSET)[0] == seq:
+                    if seq == 0:
+                        return None
+                    return Fix._make(fix)
+            time.sleep(0) # let the writer finish
+
+        raise FixBusError("{}: no consistent fix after {:d} attempts".format(
+                self.path, retries))
+
+
+    def close(self):
+        """ unmap the bus """
+
+        self.map.close()
+
+
+def _benchmark(count):
+    """ time publishing and reading count fixes on a scratch bus """
+
+    shm = os.path.dirname(DEFAULT_PATH)
+    with tempfile.NamedTemporaryFile(prefix="prismtracker-benchmark-",
+            dir=shm if os.path.isdir(shm) else None) as scratch:
+        writer = FixBusWriter(scratch.name)
+        reader = FixBusReader(scratch.name)
+
+        start = time.perf_counter()
+        for num in range(count):
+            writer.publish(37.0, -122.0, 90.0, 30.0, 100.0, num)
+        write_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(count):
+            reader.read()
+        read_time = time.perf_counter() - start
+
+        reader.close()
+        writer.close()
+
+    print("publish: {:.2f} us/fix".format(write_time / count * 1e6))
+    print("read:    {:.2f} us/fix".format(read_time / count * 1e6))
+
+
+def main():
+    """ print the latest fix from the bus """
+
+    parser = argparse.ArgumentParser(description="Read the prismtracker fix bus")
+
+    parser.add_argument('--path',
+            help='fix bus path',
+            default=DEFAULT_PATH,
+        )
+    parser.add_argument('--follow',
+            help='keep printing new fixes',
+            action='store_true',
+        )
+    parser.add_argument('--benchmark',
+            help='time publishing and reading this many fixes on a scratch bus',
+            type=int,
+            default=0,
+        )
+    parser.add_argument('--loglevel',
+            help='log level (debug, info, warning, error)',
+            default="warning",
+        )
+
+    opts = parser.parse_args()
+
+    logging.basicConfig(
+            level=getattr(logging, opts.loglevel.upper()),
+            format='%(levelname)s %(name)s.%(funcName)s:%(lineno)d - %(message)s'
+        )
+
+    if opts.benchmark > 0:
+        _benchmark(opts.benchmark)
+        return 0
+
+    try:
+        reader = FixBusReader(opts.path)
+    except (OSError, FixBusError) as error:
+        logger.error("Can't open fix bus: %s", error)
+        return 1
+
+    last_seq = None
+    while 1:
+        seq = reader.sequence()
+        if seq != last_seq:
+            try:
+                fix = reader.read()
+            except FixBusError as error:
+                if not opts.follow:
+                    logger.error("%s", error)
+                    return 1
+                # the writer is busy, try again on the next poll
+                logger.warning("%s", error)
+                time.sleep(0.1)
+                continue
+            if fix is not None:
+                print("lat: {:010.7f}, lon: {:011.7f}, course: {:06.2f}, "
+                        "speed: {:06.2f}kts, alt: {:.0f}ft, time: {}".format(
+                                fix.latitude, fix.longitude, fix.course, fix.speed,
+                                fix.altitude,
+                                time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(fix.timestamp)),
+                    ))
+            last_seq = seq
+        if not opts.follow:
+            return 0
+        time.sleep(0.1)
+
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
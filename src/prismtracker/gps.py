@@ -106,9 +106,9 @@ class GpsInterface:
 class GpsInterfaceGpsd(GpsInterface):
     """ GPSd GPS Driver using gpsd-py3 package """
 
-    def __init__(self):
+    def __init__(self, host="127.0.0.1", port=2947):
         self.packet = None
-        gpsd.connect()
+        gpsd.connect(host=host, port=port)
 
 
     def update(self):
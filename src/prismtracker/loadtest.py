@@ -0,0 +1,543 @@
+# prismtracker - An APRS Tracker Daemon
+# Copyright 2021 Philip J Freeman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Local load test harness
+
+Runs many tracker daemons against a fake gpsd and a fake APRS-IS server on
+the loopback interface and reports beacon throughput, resource usage and how
+the trackers recover from gpsd dropouts and APRS-IS disconnects.
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import shlex
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+TRACKER_CMD = "import sys; from prismtracker.tracker import main; sys.exit(main())"
+
+# failures recovery is measured after, most severe first: tracker exits,
+# APRS-IS disconnects and gpsd no-fix periods
+RECOVERY_KINDS = ('restart', 'reconnect', 'nofix')
+
+
+class FakeGpsd(socketserver.ThreadingTCPServer):
+    """
+    Minimal gpsd speaking just enough of the JSON protocol for gpsd-py3.
+
+    Every client sees the same synthetic TPV stream: a vehicle leaving
+    (lat, lon) on a fixed course at a fixed speed.  Every nofix_interval
+    seconds the fix is dropped to mode 1 for nofix_duration seconds (which
+    makes trackers raise GpsInterfaceNotReady), and client connections are
+    closed once they are older than dropout_interval seconds.  An interval
+    of 0 disables that behaviour.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, lat=37.7749, lon=-122.4194, course=90.0,
+            speed=20.0, nofix_interval=0, nofix_duration=10, dropout_interval=0):
+        self.lat = lat
+        self.lon = lon
+        self.course = course
+        self.speed = speed
+        self.nofix_interval = nofix_interval
+        self.nofix_duration = nofix_duration
+        self.dropout_interval = dropout_interval
+
+        self.start_time = time.time()
+        self.polls = 0
+        self.dropouts = 0
+        self.lock = threading.Lock()
+
+        super().__init__(address, FakeGpsdHandler)
+
+
+    def in_nofix(self, now):
+        """ returns True if the fix is dropped at now """
+
+        elapsed = now - self.start_time
+        return self.nofix_interval > 0 and elapsed % self.nofix_interval > \
+                self.nofix_interval - self.nofix_duration
+
+
+    def nofix_end(self, now):
+        """ returns the time the last no-fix period before now ended """
+
+        elapsed = now - self.start_time
+        return self.start_time + elapsed - elapsed % self.nofix_interval
+
+
+    def tpv(self):
+        """ build the current TPV report """
+
+        now = time.time()
+        elapsed = now - self.start_time
+
+        mode = 1 if self.in_nofix(now) else 3
+
+        distance = self.speed * elapsed # meters
+        lat = self.lat + math.cos(math.radians(self.course)) * distance / 111320.0
+        lon = self.lon + math.sin(math.radians(self.course)) * distance / \
+                (111320.0 * math.cos(math.radians(self.lat)))
+
+        return {
+                'class': 'TPV',
+                'mode': mode,
+                'time': "{}.{:03d}Z".format(
+                        time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(now)),
+                        int(now % 1 * 1000)),
+                'lat': lat,
+                'lon': lon,
+                'alt': 30.0,
+                'track': self.course,
+                'speed': self.speed,
+                'climb': 0.0,
+            }
+
+
+class FakeGpsdHandler(socketserver.StreamRequestHandler):
+    """ Connection handler for FakeGpsd """
+
+    def _write(self, obj):
+        self.wfile.write(json.dumps(obj).encode() + b"\n")
+
+
+    def handle(self):
+        server = self.server
+        connect_time = time.time()
+
+        self._write({'class': 'VERSION', 'release': '3.22', 'proto_major': 3,
+                'proto_minor': 14})
+
+        for line in self.rfile:
+            line = line.decode().strip()
+
+            if server.dropout_interval > 0 and \
+                    time.time() - connect_time > server.dropout_interval:
+                with server.lock:
+                    server.dropouts += 1
+                logger.debug("dropping gpsd client %s", self.client_address)
+                return
+
+            if line.startswith('?WATCH'):
+                self._write({'class': 'DEVICES', 'devices': [{'path': '/dev/fake0',
+                        'driver': 'fake', 'bps': 9600}]})
+                self._write({'class': 'WATCH', 'enable': True})
+
+            elif line.startswith('?POLL'):
+                with server.lock:
+                    server.polls += 1
+                tpv = server.tpv()
+                self._write({'class': 'POLL', 'time': tpv['time'], 'active': 1,
+                        'tpv': [tpv], 'sky': [{'class': 'SKY'}]})
+
+
+class FakeAprsIs(socketserver.ThreadingTCPServer):
+    """
+    APRS-IS sink which accepts any login and counts the frames received.
+
+    login_latency delays the login response.  Only login latency is
+    simulated: delaying reads wouldn't slow the trackers down, their sends
+    return as soon as the socket buffer takes the frame, it would only make
+    the frames be counted late.  Client connections are closed once they are
+    older than disconnect_interval seconds (0 disables that).
+
+    It also measures recovery: after a failure of some kind, the time from
+    when a tracker's frames stopped until its next frame arrives.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, login_latency=0.0, disconnect_interval=0):
+        self.login_latency = login_latency
+        self.disconnect_interval = disconnect_interval
+
+        self.logins = 0
+        self.frames = 0
+        self.disconnects = 0
+        self.frames_by_call = {}
+        self.last_frame_time = {}
+        self.max_gap = 0.0
+        self.pending_recovery = {}
+        self.recovery_times = {kind: [] for kind in RECOVERY_KINDS}
+        self.lock = threading.Lock()
+
+        super().__init__(address, FakeAprsIsHandler)
+
+
+    def expect_recovery(self, call, kind, since=None):
+        """
+        record a failure of kind affecting the tracker for call
+
+        recovery is measured from since, or from the last frame received
+        from call if since isn't given
+        """
+
+        with self.lock:
+            if since is None:
+                since = self.last_frame_time.get(call, time.time())
+            if call in self.pending_recovery:
+                # keep the earliest start and the most severe kind
+                (pending_kind, pending_since) = self.pending_recovery[call]
+                since = min(since, pending_since)
+                if RECOVERY_KINDS.index(pending_kind) < RECOVERY_KINDS.index(kind):
+                    kind = pending_kind
+            self.pending_recovery[call] = (kind, since)
+
+
+    def count_frame(self, call):
+        """ account for one frame received from call """
+
+        now = time.time()
+        with self.lock:
+            self.frames += 1
+            self.frames_by_call[call] = self.frames_by_call.get(call, 0) + 1
+
+            if call in self.last_frame_time:
+                self.max_gap = max(self.max_gap, now - self.last_frame_time[call])
+            self.last_frame_time[call] = now
+
+            if call in self.pending_recovery:
+                (kind, since) = self.pending_recovery.pop(call)
+                self.recovery_times[kind].append(now - since)
+
+
+class FakeAprsIsHandler(socketserver.StreamRequestHandler):
+    """ Connection handler for FakeAprsIs """
+
+    def handle(self):
+        server = self.server
+        connect_time = time.time()
+
+        self.wfile.write(b"# prismtracker fake APRS-IS\r\n")
+
+        login = self.rfile.readline().decode('latin-1').split()
+        if len(login) < 2 or login[0] != 'user':
+            return
+        time.sleep(server.login_latency)
+        self.wfile.write("# logresp {} verified, server FAKE\r\n".format(
+                login[1]).encode('latin-1'))
+        with server.lock:
+            server.logins += 1
+
+        for line in self.rfile:
+            line = line.decode('latin-1').strip()
+            if len(line) > 0 and not line.startswith('#'):
+                server.count_frame(line.split('>', 1)[0])
+
+            if server.disconnect_interval > 0 and \
+                    time.time() - connect_time > server.disconnect_interval:
+                with server.lock:
+                    server.disconnects += 1
+                logger.debug("disconnecting APRS-IS client %s", login[1])
+                server.expect_recovery(login[1], 'reconnect')
+                return
+
+
+class TrackerProcess:
+    """ A tracker daemon under test, restarted like systemd would """
+
+    def __init__(self, call, args, restart_delay):
+        self.call = call
+        self.args = args
+        self.restart_delay = restart_delay
+
+        self.process = None
+        self.exit_time = None
+        self.restarts = 0
+        self.cpu_ticks_done = 0
+        self.cpu_ticks = 0
+
+
+    def start(self):
+        """ start the tracker """
+
+        cmd = [sys.executable, "-c", TRACKER_CMD, "--call", self.call]
+        cmd.extend(self.args)
+        self.process = subprocess.Popen(cmd,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.exit_time = None
+
+
+    def poll(self, now):
+        """
+        collect resource usage, restarting the tracker if it has exited
+
+        returns True if the tracker has exited since the last poll
+        """
+
+        if self.exit_time is None:
+            if self.process.poll() is None:
+                self.cpu_ticks = _proc_cpu_ticks(self.process.pid) or self.cpu_ticks
+                return False
+            logger.debug("%s exited with %d", self.call, self.process.returncode)
+            self.cpu_ticks_done += self.cpu_ticks
+            self.cpu_ticks = 0
+            self.exit_time = now
+            return True
+
+        if now >= self.exit_time + self.restart_delay:
+            self.restarts += 1
+            self.start()
+        return False
+
+
+    def rss(self):
+        """ returns the current resident set size in kB """
+
+        if self.exit_time is not None:
+            return 0
+        return _proc_rss_kb(self.process.pid)
+
+
+    def stop(self):
+        """ terminate the tracker """
+
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+
+def _proc_cpu_ticks(pid):
+    """ returns utime + stime of pid in clock ticks """
+
+    try:
+        with open("/proc/{:d}/stat".format(pid), 'r') as stat_file:
+            fields = stat_file.read().rsplit(')', 1)[1].split()
+    except OSError:
+        return 0
+    return int(fields[11]) + int(fields[12])
+
+
+def _proc_rss_kb(pid):
+    """ returns the VmRSS of pid in kB """
+
+    try:
+        with open("/proc/{:d}/status".format(pid), 'r') as status_file:
+            for line in status_file:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def main():
+    """ load test entrypoint """
+
+    parser = argparse.ArgumentParser(
+            description="Run tracker daemons against a fake gpsd and APRS-IS server",
+        )
+
+    parser.add_argument('--trackers',
+            help='number of tracker daemons to run',
+            type=int,
+            default=10,
+        )
+    parser.add_argument('--duration',
+            help='seconds to run the test for',
+            type=float,
+            default=60,
+        )
+    parser.add_argument('--algorithm',
+            help='beacon algorithm passed to the trackers',
+            default='interval',
+        )
+    parser.add_argument('--algorithm-opts',
+            help='beacon algorithm options passed to the trackers',
+            default='interval=1',
+        )
+    parser.add_argument('--tracker-args',
+            help='extra arguments passed to the trackers, given with = since '
+                    'they start with a dash, e.g. --tracker-args="--rate-control"',
+            default='',
+        )
+    parser.add_argument('--speed',
+            help='fake gpsd speed in m/s',
+            type=float,
+            default=20.0,
+        )
+    parser.add_argument('--course',
+            help='fake gpsd course in degrees',
+            type=float,
+            default=90.0,
+        )
+    parser.add_argument('--nofix-interval',
+            help='seconds between fake gpsd no-fix periods (0 disables)',
+            type=float,
+            default=0,
+        )
+    parser.add_argument('--nofix-duration',
+            help='length of fake gpsd no-fix periods in seconds',
+            type=float,
+            default=10,
+        )
+    parser.add_argument('--gpsd-dropout-interval',
+            help='drop gpsd connections older than this many seconds (0 disables)',
+            type=float,
+            default=0,
+        )
+    parser.add_argument('--aprsis-login-latency',
+            help='seconds to delay APRS-IS login responses',
+            type=float,
+            default=0,
+        )
+    parser.add_argument('--aprsis-disconnect-interval',
+            help='drop APRS-IS connections older than this many seconds (0 disables)',
+            type=float,
+            default=0,
+        )
+    parser.add_argument('--restart-delay',
+            help='seconds to wait before restarting an exited tracker',
+            type=float,
+            default=5,
+        )
+    parser.add_argument('--min-rate',
+            help='exit non-zero if fewer beacons per second were received',
+            type=float,
+            default=None,
+        )
+    parser.add_argument('--json',
+            help='print the report as JSON',
+            action='store_true',
+        )
+    parser.add_argument('--loglevel',
+            help='log level (debug, info, warning, error)',
+            default="info",
+        )
+
+    opts = parser.parse_args()
+
+    logging.basicConfig(
+            level=getattr(logging, opts.loglevel.upper()),
+            format='%(levelname)s %(name)s.%(funcName)s:%(lineno)d - %(message)s'
+        )
+
+    gpsd_server = FakeGpsd(('127.0.0.1', 0),
+            course=opts.course,
+            speed=opts.speed,
+            nofix_interval=opts.nofix_interval,
+            nofix_duration=opts.nofix_duration,
+            dropout_interval=opts.gpsd_dropout_interval,
+        )
+    aprsis_server = FakeAprsIs(('127.0.0.1', 0),
+            login_latency=opts.aprsis_login_latency,
+            disconnect_interval=opts.aprsis_disconnect_interval,
+        )
+    for server in (gpsd_server, aprsis_server):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    args = [
+            "--aprsis",
+            "--aprsis-host", "127.0.0.1",
+            "--aprsis-port", str(aprsis_server.server_address[1]),
+            "--gpsd-host", "127.0.0.1",
+            "--gpsd-port", str(gpsd_server.server_address[1]),
+            "--algorithm", opts.algorithm,
+            "--algorithm-opts", opts.algorithm_opts,
+            "--loglevel", "warning",
+        ]
+    args.extend(shlex.split(opts.tracker_args))
+
+    trackers = []
+    start_time = time.time()
+    for num in range(opts.trackers):
+        tracker = TrackerProcess("LT{:04d}".format(num), args, opts.restart_delay)
+        tracker.start()
+        trackers.append(tracker)
+
+    logger.info("started %d trackers, running for %d seconds", len(trackers), opts.duration)
+
+    rss_samples = []
+    nofix = False
+    try:
+        while time.time() < start_time + opts.duration:
+            time.sleep(1)
+            now = time.time()
+            for tracker in trackers:
+                if tracker.poll(now):
+                    aprsis_server.expect_recovery(tracker.call, 'restart')
+
+            if nofix and not gpsd_server.in_nofix(now):
+                for tracker in trackers:
+                    aprsis_server.expect_recovery(tracker.call, 'nofix',
+                            gpsd_server.nofix_end(now))
+            nofix = gpsd_server.in_nofix(now)
+
+            rss_samples.append(sum(tracker.rss() for tracker in trackers))
+    finally:
+        elapsed = time.time() - start_time
+        for tracker in trackers:
+            tracker.stop()
+        gpsd_server.shutdown()
+        aprsis_server.shutdown()
+
+    cpu_ticks = sum(tracker.cpu_ticks_done + tracker.cpu_ticks for tracker in trackers)
+    report = {
+            'trackers': len(trackers),
+            'elapsed': elapsed,
+            'beacons': aprsis_server.frames,
+            'beacons_per_second': aprsis_server.frames / elapsed,
+            'silent_trackers': len(trackers) - len(aprsis_server.frames_by_call),
+            'cpu_percent': 100.0 * cpu_ticks / os.sysconf('SC_CLK_TCK') / elapsed,
+            'rss_kb_mean': sum(rss_samples) / len(rss_samples) if rss_samples else 0,
+            'rss_kb_max': max(rss_samples) if rss_samples else 0,
+            'gpsd_polls': gpsd_server.polls,
+            'gpsd_dropouts': gpsd_server.dropouts,
+            'aprsis_logins': aprsis_server.logins,
+            'aprsis_disconnects': aprsis_server.disconnects,
+            'tracker_restarts': sum(tracker.restarts for tracker in trackers),
+            'max_beacon_gap': aprsis_server.max_gap,
+        }
+    for kind in RECOVERY_KINDS:
+        times = aprsis_server.recovery_times[kind]
+        report['recoveries_' + kind] = len(times)
+        report['recovery_time_max_' + kind] = max(times) if times else 0
+    report['unrecovered'] = len(aprsis_server.pending_recovery)
+
+    if opts.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for key, value in report.items():
+            if isinstance(value, float):
+                print("{:28s} {:.2f}".format(key, value))
+            else:
+                print("{:28s} {}".format(key, value))
+
+    if opts.min_rate is not None and report['beacons_per_second'] < opts.min_rate:
+        logger.error("beacon rate %.2f/s is below the minimum of %.2f/s",
+                report['beacons_per_second'], opts.min_rate)
+        return 1
+    return 0
+
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
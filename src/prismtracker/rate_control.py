@@ -0,0 +1,373 @@
+# prismtracker - An APRS Tracker Daemon
+# Copyright 2021 Philip J Freeman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Adaptive transmit rate control"""
+
+import collections
+import logging
+import random
+import sys
+import time
+
+from prismtracker import broadcast
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS = {
+        'latency_target': 2.0,
+        'max_duty_cycle': 0.05,
+        'duty_window': 600,
+        'jitter': 0.2,
+        'max_backoff': 8,
+    }
+
+# beacon algorithm attributes holding intervals between reports
+INTERVAL_ATTRIBUTES = ('interval', 'min_interval', 'max_interval')
+
+
+class DriverStats():
+    """ Send feedback for one Broadcast Driver """
+
+    def __init__(self):
+        self.rf = False
+        self.latency = None
+        self.failures = 0
+        self.sends = collections.deque()
+        self.skip = 0
+
+
+class RateControl():
+    """
+    Rate control between a beacon algorithm and the Broadcast Drivers
+
+    Each driver has a backoff factor, the larger of:
+
+        - the moving average send latency over latency_target
+        - 2 ** the number of consecutive failed sends
+
+    clamped to 1..max_backoff.  The beacon algorithm's intervals between
+    reports are stretched by the largest factor of the drivers transmitting
+    on RF, or by their RF duty cycle over the last duty_window seconds over
+    max_duty_cycle if that is larger.  Other drivers, like APRS-IS, share no
+    channel, so rather than slowing down RF they back off on their own: a
+    driver with a factor of N only gets every Nth report, and one which
+    failed reconnects when it gets the next one.  A random jitter of up to
+    jitter times the interval is added after every report so units which
+    started together don't stay in step.
+
+    Use it in place of the beacon algorithm and send through it:
+
+        rate_c = RateControl(beacon_a)
+        if rate_c.check():
+            for bcast in bcasts:
+                rate_c.send_frame(bcast, frame)
+
+    clock and rng can be replaced to simulate congestion, see simulate().
+    """
+
+    def __init__(self, beacon_a, latency_target=2.0, max_duty_cycle=0.05,
+            duty_window=600, jitter=0.2, max_backoff=8, clock=time.monotonic,
+            rng=None):
+        self.beacon_a = beacon_a
+        self.latency_target = latency_target
+        self.max_duty_cycle = max_duty_cycle
+        self.duty_window = duty_window
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self.rng = rng or random.Random()
+
+        self.base_intervals = {}
+        for name in INTERVAL_ATTRIBUTES:
+            if hasattr(beacon_a, name):
+                self.base_intervals[name] = getattr(beacon_a, name)
+
+        self.stats = {}
+        self.jitter_factor = self.rng.uniform(0, self.jitter)
+        self.last_backoff = 1.0
+        self.logged_backoff = 1.0
+
+
+    def duty_cycle(self, bcast):
+        """ returns the fraction of the duty window bcast spent transmitting """
+
+        sends = self.stats[bcast].sends
+        cutoff = self.clock() - self.duty_window
+        while sends and sends[0][0] < cutoff:
+            sends.popleft()
+        return sum(airtime for (_, airtime) in sends) / self.duty_window
+
+
+    def driver_backoff(self, stats):
+        """ returns the backoff factor from a driver's latency and failures """
+
+        factor = 2.0 ** min(stats.failures, 16)
+        if stats.latency is not None:
+            factor = max(factor, stats.latency / self.latency_target)
+        return min(factor, self.max_backoff)
+
+
+    def backoff(self):
+        """ returns the current factor to stretch intervals by """
+
+        factor = 1.0
+        for (bcast, stats) in self.stats.items():
+            if not stats.rf:
+                continue
+            factor = max(factor, self.driver_backoff(stats))
+            factor = max(factor, self.duty_cycle(bcast) / self.max_duty_cycle)
+        return min(factor, self.max_backoff)
+
+
+    def check(self):
+        """ check to see if we should send a position report now """
+
+        backoff = self.backoff()
+        if backoff != self.last_backoff:
+            # the duty cycle moves the backoff by up to ~20% as sends enter and
+            # leave the window, only report steps of more than 25% or to and
+            # from no backoff
+            if (backoff == 1.0) != (self.logged_backoff == 1.0) or \
+                    abs(backoff - self.logged_backoff) > 0.25 * self.logged_backoff:
+                logger.info("rate control backoff now %.2f", backoff)
+                self.logged_backoff = backoff
+            else:
+                logger.debug("rate control backoff now %.2f", backoff)
+            self.last_backoff = backoff
+
+        for (name, base) in self.base_intervals.items():
+            setattr(self.beacon_a, name, base * (backoff + self.jitter_factor))
+
+        if not self.beacon_a.check():
+            return False
+
+        self.jitter_factor = self.rng.uniform(0, self.jitter)
+        return True
+
+
+    def send_frame(self, bcast, frame):
+        """
+        send a frame with bcast, recording the feedback
+
+        returns False if the broadcast failed or was skipped to back off
+        """
+
+        stats = self.stats.setdefault(bcast, DriverStats())
+        airtime = bcast.airtime(frame)
+        stats.rf = airtime > 0
+
+        if stats.skip > 0:
+            stats.skip -= 1
+            logger.debug("%s backing off, skipping this report", type(bcast).__name__)
+            return False
+
+        start = self.clock()
+        try:
+            bcast.send_frame(frame)
+        except broadcast.BroadcastError as error:
+            stats.failures += 1
+            logger.error("%s failed (%d in a row): %s",
+                    type(bcast).__name__, stats.failures, error)
+        else:
+            stats.failures = 0
+            if stats.rf:
+                stats.sends.append((start, airtime))
+        finally:
+            latency = self.clock() - start
+            if stats.latency is None:
+                stats.latency = latency
+            else:
+                stats.latency = 0.8 * stats.latency + 0.2 * latency
+
+        if not stats.rf:
+            stats.skip = round(self.driver_backoff(stats)) - 1
+            if stats.skip > 0:
+                logger.log(logging.INFO if stats.failures > 0 else logging.DEBUG,
+                        "%s backing off, skipping the next %d reports",
+                        type(bcast).__name__, stats.skip)
+
+        return stats.failures == 0
+
+
+class SimulatedClock():
+    """ A clock for RateControl which only moves when told to """
+
+    def __init__(self):
+        self.now = 0.0
+
+
+    def __call__(self):
+        return self.now
+
+
+    def advance(self, seconds):
+        """ move the clock forward """
+        self.now += seconds
+
+
+class SimulatedBeacon():
+    """ Interval beacon algorithm running on a SimulatedClock """
+
+    def __init__(self, clock, interval=60):
+        self.clock = clock
+        self.interval = interval
+        self.last_report = None
+
+
+    def check(self):
+        """ check to see if we should send a position report now """
+
+        if self.last_report is not None and self.clock() < self.last_report + self.interval:
+            return False
+        self.last_report = self.clock()
+        return True
+
+
+class SimulatedBroadcast(broadcast.Broadcast):
+    """
+    Broadcast Driver which takes latency seconds of a SimulatedClock per send
+    and raises a BroadcastError while failing is set
+    """
+
+    def __init__(self, clock, airtime=0):
+        self.clock = clock
+        self.frame_airtime = airtime
+        self.latency = 0
+        self.failing = False
+        self.sent = 0
+        self.attempts = 0
+
+
+    def send_frame(self, frame):
+        self.attempts += 1
+        self.clock.advance(self.latency)
+        if self.failing:
+            raise broadcast.BroadcastError("simulated failure")
+        self.sent += 1
+
+
+    def airtime(self, frame):
+        return self.frame_airtime
+
+
+def simulate():
+    """
+    Drive RateControl through congestion scenarios on a simulated clock
+
+    An RF and an APRS-IS driver beacon every 60 seconds while APRS-IS fails,
+    APRS-IS is slow, RF fails, RF is slow and RF is over its duty cycle, with
+    calm periods in between.  Checks that RF congestion stretches the beacon
+    interval, that APRS-IS trouble only backs off APRS-IS, and that both
+    recover afterwards.
+
+    returns True if all checks passed
+    """
+
+    clock = SimulatedClock()
+    rate_c = RateControl(SimulatedBeacon(clock, interval=60), clock=clock,
+            rng=random.Random(0))
+    rf_bcast = SimulatedBroadcast(clock, airtime=0.5)
+    aprsis_bcast = SimulatedBroadcast(clock)
+
+    def run(seconds):
+        """
+        returns the largest backoff, the number of reports and the number of
+        APRS-IS send attempts over seconds
+        """
+
+        end = clock() + seconds
+        max_backoff = 1.0
+        reports = 0
+        aprsis_attempts = aprsis_bcast.attempts
+        while clock() < end:
+            clock.advance(1)
+            if rate_c.check():
+                reports += 1
+                for bcast in (rf_bcast, aprsis_bcast):
+                    rate_c.send_frame(bcast, "SIM>APZFSM:>simulated")
+            max_backoff = max(max_backoff, rate_c.last_backoff)
+        return (max_backoff, reports, aprsis_bcast.attempts - aprsis_attempts)
+
+    passed = True
+
+    def check(name, result):
+        nonlocal passed
+        print("{:28s} {}".format(name, "ok" if result else "FAILED"))
+        passed = passed and result
+
+    (max_backoff, reports, attempts) = run(1200)
+    check("calm", max_backoff == 1.0 and attempts == reports)
+
+    # a dead uplink takes the connect timeout to fail
+    aprsis_bcast.failing = True
+    aprsis_bcast.latency = 20
+    (max_backoff, reports, attempts) = run(3600)
+    check("aprsis_failing_rf_unslowed", max_backoff == 1.0 and reports >= 3600 // 72)
+    check("aprsis_failing_backoff", attempts <= reports // 4)
+    aprsis_bcast.failing = False
+    aprsis_bcast.latency = 0
+    run(3600)
+    (max_backoff, reports, attempts) = run(600)
+    check("aprsis_failing_recovered", max_backoff == 1.0 and attempts == reports)
+
+    aprsis_bcast.latency = 6
+    (max_backoff, reports, attempts) = run(3600)
+    check("aprsis_slow_rf_unslowed", max_backoff == 1.0)
+    check("aprsis_slow_backoff", attempts <= reports // 2)
+    aprsis_bcast.latency = 0
+    run(3600)
+    (max_backoff, reports, attempts) = run(600)
+    check("aprsis_slow_recovered", attempts == reports)
+
+    rf_bcast.failing = True
+    (max_backoff, _, _) = run(1800)
+    check("rf_failing_backoff", max_backoff == rate_c.max_backoff)
+    rf_bcast.failing = False
+    run(1800)
+    check("rf_failing_recovered", rate_c.backoff() == 1.0)
+
+    rf_bcast.latency = 6
+    (max_backoff, _, _) = run(1800)
+    check("rf_slow_backoff", max_backoff > 2.0)
+    rf_bcast.latency = 0
+    run(1800)
+    check("rf_slow_recovered", rate_c.backoff() == 1.0)
+
+    rf_bcast.frame_airtime = 9
+    rf_sent = rf_bcast.sent
+    (max_backoff, _, _) = run(3600)
+    airtime = (rf_bcast.sent - rf_sent) * rf_bcast.frame_airtime
+    check("rf_duty_cycle_backoff",
+            max_backoff > 1.0 and airtime / 3600 < 9 / 60)
+    rf_bcast.frame_airtime = 0.5
+    run(1200)
+    check("rf_duty_cycle_recovered", rate_c.backoff() == 1.0)
+
+    return passed
+
+
+def main():
+    """ run the rate control simulation, python3 -m prismtracker.rate_control """
+
+    logging.basicConfig(level=logging.CRITICAL)
+    return 0 if simulate() else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,147 @@
+# prismtracker - An APRS Tracker Daemon
+# Copyright 2021 Philip J Freeman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Streaming track simplification"""
+
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS = 6371008.8 # meters
+
+
+def _project(lat0, lon0, lat, lon):
+    """
+    project (lat, lon) to local x, y meters around (lat0, lon0)
+
+    NOTE: equirectangular, good enough over the few km of a window
+    """
+    x = math.radians(lon - lon0) * math.cos(math.radians(lat0)) * EARTH_RADIUS
+    y = math.radians(lat - lat0) * EARTH_RADIUS
+    return (x, y)
+
+
+def _segment_distance(point, start, end):
+    """ distance from point to the line segment start-end in the same units """
+
+    seg_x = end[0] - start[0]
+    seg_y = end[1] - start[1]
+    seg_len2 = seg_x * seg_x + seg_y * seg_y
+
+    if seg_len2 == 0:
+        return math.hypot(point[0] - start[0], point[1] - start[1])
+
+    ratio = ((point[0] - start[0]) * seg_x + (point[1] - start[1]) * seg_y) / seg_len2
+    ratio = max(0.0, min(1.0, ratio))
+    return math.hypot(
+            point[0] - start[0] - ratio * seg_x,
+            point[1] - start[1] - ratio * seg_y,
+        )
+
+
+class TrackSimplifier():
+    """
+    Sliding window track simplifier
+
+    Keeps an anchor point and a window of the fixes received since.  As long
+    as every fix in the window is within tolerance meters of the straight
+    line from the anchor to the newest fix, the fixes in between are
+    dropped.  When that stops being true the previous fix is kept and becomes
+    the new anchor.  Fixes within deadband meters of the last fix accepted
+    into the window are dropped outright, which suppresses GPS jitter while
+    stationary.  A point is always kept after max_points fixes so the window
+    and the delay before a point is written stay bounded.
+
+    Use it like this:
+
+        simplifier = TrackSimplifier(tolerance=5, deadband=3)
+        for fix in fixes:
+            for item in simplifier.add(fix.lat, fix.lon, fix):
+                write(item)
+        for item in simplifier.flush():
+            write(item)
+    """
+
+    def __init__(self, tolerance=5.0, deadband=0.0, max_points=100):
+        self.tolerance = tolerance
+        self.deadband = deadband
+        self.max_points = max_points
+
+        self.anchor = None
+        self.window = []
+
+
+    def add(self, lat, lon, item):
+        """
+        add a fix to the track
+
+        returns a list of items which are now final and should be written
+        """
+
+        if self.anchor is None:
+            self.anchor = (lat, lon, item)
+            return [item]
+
+        (anchor_lat, anchor_lon, _) = self.anchor
+        point = _project(anchor_lat, anchor_lon, lat, lon)
+
+        if self.deadband > 0:
+            (last_lat, last_lon, _) = self.window[-1] if self.window else self.anchor
+            last = _project(anchor_lat, anchor_lon, last_lat, last_lon)
+            if math.hypot(point[0] - last[0], point[1] - last[1]) < self.deadband:
+                logger.debug("dropping fix inside %s m dead band", self.deadband)
+                return []
+
+        if len(self.window) < self.max_points:
+            for (win_lat, win_lon, _) in self.window:
+                win_point = _project(anchor_lat, anchor_lon, win_lat, win_lon)
+                if _segment_distance(win_point, (0.0, 0.0), point) > self.tolerance:
+                    break
+            else:
+                self.window.append((lat, lon, item))
+                return []
+
+        self.anchor = self.window[-1]
+        self.window = [(lat, lon, item)]
+        return [self.anchor[2]]
+
+
+    def pending(self):
+        """
+        returns a list of the item flush() would return, without ending the
+        track, for writing out a snapshot of the track so far
+        """
+
+        if self.window:
+            return [self.window[-1][2]]
+        return []
+
+
+    def flush(self):
+        """
+        end the track
+
+        returns a list of the remaining items to be written
+        """
+
+        out = self.pending()
+        self.anchor = None
+        self.window = []
+        return out
+
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
@@ -17,13 +17,17 @@
 """An APRS Tracker Daemon"""
 
 import argparse
+import atexit
+import datetime
 import logging
 import os
+import signal
+import sys
 import time
 
 import gpxpy
 
-from prismtracker import aprs, broadcast, gps, beacon_algorithm
+from prismtracker import aprs, broadcast, gps, beacon_algorithm, fixbus, rate_control, simplify
 
 def main():
     """ main daemon entrypoint """
@@ -50,6 +54,15 @@ def main():
             help='Passcode for connecting to APRS-IS',
             default='',
         )
+    parser.add_argument('--aprsis-host',
+            help='APRS-IS server hostname',
+            default='rotate.aprs.net',
+        )
+    parser.add_argument('--aprsis-port',
+            help='APRS-IS server port',
+            type=int,
+            default=14580,
+        )
     parser.add_argument('--path',
             help="via path",
             default="WIDE1-1,WIDE2-1",
@@ -58,6 +71,20 @@ def main():
             help='GPS mode (gpsd, etc...)',
             default='gpsd',
         )
+    parser.add_argument('--gpsd-host',
+            help='gpsd hostname',
+            default='127.0.0.1',
+        )
+    parser.add_argument('--gpsd-port',
+            help='gpsd port',
+            type=int,
+            default=2947,
+        )
+    parser.add_argument('--fix-bus',
+            help='publish each fix to this shared memory file (e.g. {})'.format(
+                    fixbus.DEFAULT_PATH),
+            default=None,
+        )
     parser.add_argument('--symbol-table',
             help='APRS display symbol table',
             default='/',
@@ -81,6 +108,14 @@ def main():
     parser.add_argument('--algorithm-opts',
             default='',
         )
+    parser.add_argument('--rate-control',
+            help='back off beaconing when broadcasts are slow, failing or the duty cycle is high',
+            action='store_true',
+        )
+    parser.add_argument('--rate-control-opts',
+            help='e.g. latency_target=2,max_duty_cycle=0.05,duty_window=600,jitter=0.2,max_backoff=8',
+            default='',
+        )
     parser.add_argument('--loglevel',
             help='log level (debug, info, warning, error)',
             default="info",
@@ -89,6 +124,16 @@ def main():
             help='log gpx of position reports',
             default=None,
         )
+    parser.add_argument('--log-gpx-tolerance',
+            help='drop logged positions within this many meters of a straight track (0 logs all)',
+            type=float,
+            default=0,
+        )
+    parser.add_argument('--log-gpx-deadband',
+            help='drop logged positions within this many meters of the previous one',
+            type=float,
+            default=0,
+        )
 
 
     opts = parser.parse_args()
@@ -115,18 +160,24 @@ def main():
 
     # Setup GPS Interface
     if opts.gps == 'gpsd':
-        gps_i = gps.GpsInterfaceGpsd()
+        gps_i = gps.GpsInterfaceGpsd(opts.gpsd_host, opts.gpsd_port)
     else:
         logger.error("Unknown GPS interface: %s", opts.gps)
         return 2
 
+    fix_bus = None
+    if opts.fix_bus:
+        fix_bus = fixbus.FixBusWriter(opts.fix_bus)
+
     # Setup broadcasters
     bcasts = []
     if opts.beacon:
         bcast = broadcast.BroadcastAx25Beacon(ax25_port=opts.beacon_port)
         bcasts.append(bcast)
     if opts.aprsis:
-        bcast = broadcast.BroadcastAprsIs(opts.call, opts.aprsis_passcode)
+        bcast = broadcast.BroadcastAprsIs(opts.call, opts.aprsis_passcode,
+                opts.aprsis_host, opts.aprsis_port,
+            )
         bcasts.append(bcast)
 
     # Setup GPX log
@@ -137,41 +188,62 @@ def main():
         except:
             gpx = gpxpy.gpx.GPX()
 
-        gpx_track_positions = gpxpy.gpx.GPXTrack()
+        gpx_track_positions = gpxpy.gpx.GPXTrack(name="positions")
         gpx.tracks.append(gpx_track_positions)
         gpx_segment_positions = gpxpy.gpx.GPXTrackSegment()
         gpx_track_positions.segments.append(gpx_segment_positions)
 
-        gpx_track_broadcasts = gpxpy.gpx.GPXTrack()
+        track_simplifier = None
+        if opts.log_gpx_tolerance > 0 or opts.log_gpx_deadband > 0:
+            track_simplifier = simplify.TrackSimplifier(
+                    opts.log_gpx_tolerance,
+                    opts.log_gpx_deadband,
+                )
+
+        gpx_track_broadcasts = gpxpy.gpx.GPXTrack(name="broadcasts")
         gpx.tracks.append(gpx_track_broadcasts)
         gpx_segment_broadcasts = gpxpy.gpx.GPXTrackSegment()
         gpx_track_broadcasts.segments.append(gpx_segment_broadcasts)
 
-    # Parse Beaconing Options
-    algorithm_opts = {
-        'interval': 300,
-        'min_interval': 30,
-        'max_interval': 600,
-            }
-    if len(opts.algorithm_opts) > 0:
-        for item in opts.algorithm_opts.split(','):
-            parts = item.split('=')
-            if len(parts) != 2:
-                logger.error("Malformed Algorithm opt: %s, ignoring...", item)
-            else:
-                algorithm_opts[parts[0]] = parts[1]
+        def write_gpx_log(final=False):
+            """ write the GPX log, including the fix held by the simplifier """
+
+            held = []
+            if track_simplifier is not None:
+                held = track_simplifier.flush() if final else track_simplifier.pending()
+            if final and not held and not gpx_segment_positions.points:
+                return
+
+            gpx_segment_positions.points.extend(held)
+            with open(opts.log_gpx, 'w') as gpx_file:
+                gpx_file.write(gpx.to_xml(version="1.0"))
+            if not final:
+                del gpx_segment_positions.points[len(gpx_segment_positions.points) - len(held):]
+
+        # make sure the end of the track is logged when we're stopped
+        atexit.register(write_gpx_log, True)
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
 
     # Setup Beaconing Algorithm
-    if opts.algorithm == 'interval':
-        beacon_a = beacon_algorithm.BeaconAlgorithmInterval(gps_i, int(algorithm_opts['interval']))
+    algorithm_opts = beacon_algorithm.parse_options(opts.algorithm_opts)
+    beacon_a = beacon_algorithm.new_algorithm(opts.algorithm, gps_i, algorithm_opts)
+    if beacon_a is None:
+        logger.error("Unknown Beacon Algorithm: %s", opts.algorithm)
+        return 2
 
-    elif opts.algorithm == 'smart':
-        beacon_a = beacon_algorithm.BeaconAlgorithmSmart(gps_i,
-                int(algorithm_opts['min_interval']),
-                int(algorithm_opts['max_interval']),
+    # Setup Rate Control
+    rate_c = None
+    if opts.rate_control:
+        rate_opts = beacon_algorithm.parse_options(opts.rate_control_opts,
+                rate_control.DEFAULT_OPTIONS, label="Rate control")
+        rate_c = rate_control.RateControl(beacon_a,
+                latency_target=float(rate_opts['latency_target']),
+                max_duty_cycle=float(rate_opts['max_duty_cycle']),
+                duty_window=float(rate_opts['duty_window']),
+                jitter=float(rate_opts['jitter']),
+                max_backoff=float(rate_opts['max_backoff']),
             )
-    else:
-        logger.error("Unknown Beacon Algorithm: %s", opts.algorithm)
+        beacon_a = rate_c
 
     while 1:
 
@@ -194,13 +266,27 @@ def main():
         gps_altitude = gps_i.get_altitude()
         (gps_course, gps_speed) = gps_i.get_course_and_speed()
 
+        # Publish the fix for other local processes
+        if fix_bus is not None:
+            fix_bus.publish(gps_latitude, gps_longitude, gps_course, gps_speed,
+                    gps_altitude, gps_i.get_timestamp())
+
         # Log the position to GPX log track #1
         if opts.log_gpx is not None:
-            gpx_segment_positions.points.append(gpxpy.gpx.GPXTrackPoint(
+            gpx_point = gpxpy.gpx.GPXTrackPoint(
                     gps_latitude, gps_longitude,
                     elevation=gps_altitude * 0.3048, # ft -> meters
+                    time=datetime.datetime.fromtimestamp(gps_i.get_timestamp(),
+                            datetime.timezone.utc),
                     speed=gps_speed * 0.5144447 # kts -> M/s
-                ))
+                )
+            gpx_point.course = gps_course
+            if track_simplifier is not None:
+                gpx_segment_positions.points.extend(track_simplifier.add(
+                        gps_latitude, gps_longitude, gpx_point
+                    ))
+            else:
+                gpx_segment_positions.points.append(gpx_point)
 
         # Check to see if we should send a packet yet
         if beacon_a.check(): # True means send a packet
@@ -237,17 +323,23 @@ def main():
 
         # Broadcast It!
         for bcast in bcasts:
-            bcast.send_frame(frame)
+            if rate_c is not None:
+                rate_c.send_frame(bcast, frame)
+            else:
+                bcast.send_frame(frame)
 
         # Log the position broadcast to GPX log track #2
         if opts.log_gpx is not None:
-            gpx_segment_broadcasts.points.append(gpxpy.gpx.GPXTrackPoint(
+            gpx_point = gpxpy.gpx.GPXTrackPoint(
                     gps_latitude, gps_longitude,
                     elevation=gps_altitude * 0.3048, # ft -> meters
+                    time=datetime.datetime.fromtimestamp(gps_i.get_timestamp(),
+                            datetime.timezone.utc),
                     speed=gps_speed * 0.5144447 # kts -> M/s
-                ))
-            with open(opts.log_gpx, 'w') as gpx_file:
-                gpx_file.write(gpx.to_xml(version="1.0"))
+                )
+            gpx_point.course = gps_course
+            gpx_segment_broadcasts.points.append(gpx_point)
+            write_gpx_log()
 
 
 # vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4